@@ -0,0 +1,23 @@
+"""Compilation of hz.py's --filter_expr, kept free of ROS imports."""
+
+# Globals for evaluating --filter_expr; the message is added as ``m``.
+_FILTER_GLOBALS = {}
+
+def compile_filter_expr(expr):
+    """Turn --filter_expr into a predicate taking the message.
+
+    ``expr`` is either an expression over ``m`` (e.g. "m.data == 'foo'") or,
+    for backwards compatibility, one that evaluates to a callable (e.g.
+    "lambda m: m.data == 'foo'"), which is then called per message.
+    """
+    code = compile(expr, '<filter_expr>', 'eval')
+    if 'm' not in code.co_names:
+        value = eval(code, _FILTER_GLOBALS)
+        if callable(value):
+            return value
+
+    def predicate(m):
+        # Bind ``m`` as a global: nested scopes such as generator expressions
+        # do not see eval's locals.
+        return eval(code, {**_FILTER_GLOBALS, 'm': m})
+    return predicate
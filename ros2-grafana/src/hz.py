@@ -1,7 +1,5 @@
 from argparse import ArgumentTypeError
-from collections import defaultdict
-import functools
-import math
+import os
 import threading
 import rclpy
 from rclpy.callback_groups import MutuallyExclusiveCallbackGroup
@@ -14,6 +12,9 @@ from ros2topic.api import get_msg_class
 from ros2topic.api import TopicNameCompleter
 from ros2topic.verb import VerbExtension
 
+from filter_expr import compile_filter_expr
+from topic_state import ONE_SEC_NS, TopicState, compute_hz
+
 DEFAULT_WINDOW_SIZE = 10000
 
 def positive_int(string):
@@ -44,7 +45,7 @@ class HzVerb(VerbExtension):
         parser.add_argument(
             '--filter_expr',
             dest='filter_expr', default=None,
-            help='Only measure messages matching the specified Python expression', 
+            help="Only measure messages matching the specified Python expression, with the message available as 'm' (e.g. \"m.data == 'foo'\"); an expression evaluating to a callable such as \"lambda m: ...\" is also accepted", 
             metavar='EXPR'
         )
         
@@ -63,123 +64,101 @@ class ROSTopicHz:
     """ROSTopicHz receives messages for a topic and computes frequency."""
 
     def __init__(self, node, window_size, filter_expr=None, use_wtime=False):
-        self.lock = threading.Lock()
-        self.msg_t0 = -1
-        self.msg_tn = 0
-        self.times = []
-        self._last_printed_tn = defaultdict(int)
-        self._msg_t0 = defaultdict(lambda: -1)
-        self._msg_tn = defaultdict(int)
-        self._times = defaultdict(list)
+        self._by_topic = {}
+        self._ready = set()
+        self._ready_lock = threading.Lock()
         self.filter_expr = filter_expr
         self.use_wtime = use_wtime
         self.window_size = window_size
         self._clock = node.get_clock()
-
-    def get_last_printed_tn(self, topic=None):
-        return self._last_printed_tn[topic] if topic else self.last_printed_tn
-
-    def set_last_printed_tn(self, value, topic=None):
-        if topic is None:
-            self.last_printed_tn = value
-        else:
-            self._last_printed_tn[topic] = value
-
-    def get_msg_t0(self, topic=None):
-        return self._msg_t0[topic] if topic else self.msg_t0
-
-    def set_msg_t0(self, value, topic=None):
-        if topic is None:
-            self.msg_t0 = value
-        else:
-            self._msg_t0[topic] = value
-
-    def get_msg_tn(self, topic=None):
-        return self._msg_tn[topic] if topic else self.msg_tn
-
-    def set_msg_tn(self, value, topic=None):
-        if topic is None:
-            self.msg_tn = value
-        else:
-            self._msg_tn[topic] = value
-
-    def get_times(self, topic=None):
-        return self._times[topic] if topic else self.times
-
-    def set_times(self, value, topic=None):
-        if topic is None:
-            self.times = value
-        else:
-            self._times[topic] = value
-
-    def callback_hz(self, m, topic=None):
-        """Calculate interval time for topic."""
-        if self.filter_expr and not self.filter_expr(m):
-            return
-        
-        with self.lock:
-            curr_rostime = self._clock.now() if not self.use_wtime else Clock(clock_type=ClockType.SYSTEM_TIME).now()
-
-            if curr_rostime.nanoseconds == 0:
-                if len(self.get_times(topic=topic)) > 0:
-                    print('Time has reset, resetting counters')
-                    self.set_times([], topic=topic)
-                return
-
-            curr = curr_rostime.nanoseconds
-            msg_t0 = self.get_msg_t0(topic=topic)
-
-            if msg_t0 < 0 or msg_t0 > curr:
-                self.set_msg_t0(curr, topic=topic)
-                self.set_msg_tn(curr, topic=topic)
-                self.set_times([], topic=topic)
+        self._wclock = Clock(clock_type=ClockType.SYSTEM_TIME)
+        self._active_clock = self._wclock if use_wtime else self._clock
+
+    def register_topic(self, topic):
+        """Allocate the state for ``topic``; call before subscribing to it."""
+        state = self._by_topic[topic] = TopicState(self.window_size)
+        return state
+
+    def pop_ready(self):
+        """Return the topics that have a new rate to report, and clear them."""
+        with self._ready_lock:
+            ready, self._ready = self._ready, set()
+        return ready
+
+    def _mark_ready(self, topic):
+        with self._ready_lock:
+            self._ready.add(topic)
+
+    def _reset_time(self, state):
+        if state.count:
+            print('Time has reset, resetting counters')
+            state.reset()
+
+    def make_callback(self, topic, state):
+        """Build the subscription callback for ``topic``, whose window is ``state``.
+
+        The clock and filter never change for a subscription, so one of four
+        specialized closures is picked here instead of branching per message.
+        """
+        now = self._active_clock.now
+        on_sample = state.on_sample
+        mark_ready = self._mark_ready
+        filter_expr = self.filter_expr
+
+        if self.use_wtime:
+            # The system clock never reads zero, so there is no reset to detect.
+            if filter_expr is None:
+                def callback_hz(m):
+                    if on_sample(now().nanoseconds):
+                        mark_ready(topic)
             else:
-                self.get_times(topic=topic).append(curr - self.get_msg_tn(topic=topic))
-                self.set_msg_tn(curr, topic=topic)
-
-            if len(self.get_times(topic=topic)) > self.window_size:
-                self.get_times(topic=topic).pop(0)
-
-    def get_hz(self, topic=None):
-        """Calculate the average publishing rate."""
-        if not self.get_times(topic=topic):
-            return
-        
-        if self.get_last_printed_tn(topic=topic) == 0:
-            self.set_last_printed_tn(self.get_msg_tn(topic=topic), topic=topic)
-            return
-        
-        if self.get_msg_tn(topic=topic) < self.get_last_printed_tn(topic=topic) + 1e9:
-            return
-
-        with self.lock:
-            times = self.get_times(topic=topic)
-            n = len(times)
-            mean = sum(times) / n
-            rate = 1. / mean if mean > 0. else 0
-            std_dev = math.sqrt(sum((x - mean)**2 for x in times) / n)
-            max_delta = max(times)
-            min_delta = min(times)
-
-            self.set_last_printed_tn(self.get_msg_tn(topic=topic), topic=topic)
-
-        return rate, min_delta, max_delta, std_dev, n
-
-    def print_hz(self, topic=None):
+                def callback_hz(m):
+                    if not filter_expr(m):
+                        return
+                    if on_sample(now().nanoseconds):
+                        mark_ready(topic)
+            return callback_hz
+
+        reset_time = self._reset_time
+        if filter_expr is None:
+            def callback_hz(m):
+                curr = now().nanoseconds
+                if curr == 0:
+                    reset_time(state)
+                elif on_sample(curr):
+                    mark_ready(topic)
+        else:
+            def callback_hz(m):
+                if not filter_expr(m):
+                    return
+                curr = now().nanoseconds
+                if curr == 0:
+                    reset_time(state)
+                elif on_sample(curr):
+                    mark_ready(topic)
+        return callback_hz
+
+    def get_hz(self, topic):
+        """Calculate the average publishing rate, in Hz."""
+        return compute_hz(self._by_topic[topic])
+
+    def print_hz(self, topic):
         """Print the average publishing rate."""
         result = self.get_hz(topic)
         if result is None:
             return
         
         rate, min_delta, max_delta, std_dev, window = result
-        print(f'average rate: {rate * 1e9:.3f}\n\tmin: {min_delta * 1e-9:.3f}s max: {max_delta * 1e-9:.3f}s std dev: {std_dev * 1e-9:.5f}s window: {window}')
+        print(f'average rate: {rate:.3f}\n\tmin: {min_delta / ONE_SEC_NS:.3f}s max: {max_delta / ONE_SEC_NS:.3f}s std dev: {std_dev / ONE_SEC_NS:.5f}s window: {window}')
 
 def _rostopic_hz(update_cb, node, topic_list, window_size=DEFAULT_WINDOW_SIZE, filter_expr=None, use_wtime=False):
     """Print the publishing rate of a topic periodically."""
+    # Only arrival times matter, so keep a short history: enough to ride out
+    # executor jitter without DDS buffering every undelivered message.
     qos_profile = QoSProfile(
         reliability=QoSReliabilityPolicy.BEST_EFFORT,
-        history=QoSHistoryPolicy.KEEP_ALL,
-        depth=window_size,
+        history=QoSHistoryPolicy.KEEP_LAST,
+        depth=10,
     )
 
     rt = ROSTopicHz(node, window_size, filter_expr=filter_expr, use_wtime=use_wtime)
@@ -191,29 +170,48 @@ def _rostopic_hz(update_cb, node, topic_list, window_size=DEFAULT_WINDOW_SIZE, f
             print(f'{topic} is invalid')
             continue
 
+        state = rt.register_topic(topic)
         node.create_subscription(
             msg_class,
             topic,
-            functools.partial(rt.callback_hz, topic=topic),
-            qos_profile
+            rt.make_callback(topic, state),
+            qos_profile,
+            # One group per subscription: topics run in parallel on the
+            # MultiThreadedExecutor, with a single writer per TopicState.
+            callback_group=MutuallyExclusiveCallbackGroup(),
+            # Without a filter the payload is never read, so skip deserializing.
+            raw=filter_expr is None
         )
 
-    while rclpy.ok():
-        rclpy.spin_once(node)
+    def emit_hz():
         hz_dict = {}
-        for topic in topic_list:
+        for topic in rt.pop_ready():
             hz = rt.get_hz(topic)
             if hz:
-                hz_dict[topic] = hz[0] * 1e9
-        if update_cb:
+                hz_dict[topic] = hz[0]
+        if update_cb and hz_dict:
             update_cb(hz_dict)
 
+    # Each tick reports every topic that got samples since the previous one,
+    # so the 1 Hz timer alone sets the reporting period. It runs on a steady
+    # clock so it keeps firing with use_sim_time and no /clock publisher
+    # (--wall-time).
+    node.create_timer(1.0, emit_hz, callback_group=MutuallyExclusiveCallbackGroup(),
+                      clock=Clock(clock_type=ClockType.STEADY_TIME))
+
+    executor = MultiThreadedExecutor(num_threads=os.cpu_count())
+    executor.add_node(node)
+    try:
+        executor.spin()
+    finally:
+        executor.shutdown()
+
     node.destroy_node()
     rclpy.shutdown()
 
 def main(args, update_cb=None):
     topic_list = args.topic_list
-    filter_expr = eval(args.filter_expr) if args.filter_expr else None
+    filter_expr = compile_filter_expr(args.filter_expr) if args.filter_expr else None
 
     with DirectNode(args) as node:
         _rostopic_hz(update_cb, node.node, topic_list, window_size=args.window_size, filter_expr=filter_expr, use_wtime=args.use_wtime)
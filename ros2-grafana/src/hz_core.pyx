@@ -0,0 +1,141 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""Optional compiled TopicState for hz.py.
+
+Mirrors topic_state.PyTopicState with the window kept in typed C fields. It is
+only used once built explicitly, in this directory:
+
+    cythonize -i hz_core.pyx
+
+The sum of squared deviations (m2) is updated Welford-style because an int64
+sum of squares would overflow for long windows, and is recomputed from the
+buffer each time the ring wraps.
+"""
+from libc.stdint cimport int64_t
+import numpy as np
+
+# The writer holds the GIL for the whole update, so a reader that keeps seeing
+# an odd version is looking at a writer that failed midway, not a live one.
+cdef int _MAX_SNAPSHOT_RETRIES = 1000
+
+
+cdef class TopicState:
+    cdef object _arr
+    cdef int64_t[::1] buf
+    cdef readonly Py_ssize_t size, head, count
+    cdef readonly int64_t s1
+    cdef readonly double m2
+    cdef readonly unsigned long version
+    cdef public int64_t msg_t0, msg_tn
+    cdef public bint pending
+
+    def __cinit__(self, Py_ssize_t window_size):
+        if window_size < 1:
+            raise ValueError('window_size must be a positive integer')
+        self._arr = np.empty(window_size, dtype=np.int64)
+        self.buf = self._arr
+        self.size = window_size
+        self.msg_t0 = -1
+
+    def on_sample(self, int64_t curr):
+        """Record a message received at ``curr`` nanoseconds.
+
+        Returns True for the first sample since the reader last cleared
+        ``pending`` (see topic_state.compute_hz).
+        """
+        return self._push(curr)
+
+    cdef inline void _clear(self):
+        self.head = 0
+        self.count = 0
+        self.s1 = 0
+        self.m2 = 0.
+
+    cdef inline void _resync(self):
+        # Recompute s1 and m2 from the window once per wrap, so rounding
+        # error in the incremental m2 updates cannot build up over time.
+        cdef Py_ssize_t i
+        cdef int64_t s1 = 0
+        cdef double mean, d, m2 = 0.
+
+        for i in range(self.count):
+            s1 += self.buf[i]
+        mean = <double>s1 / self.count
+        for i in range(self.count):
+            d = self.buf[i] - mean
+            m2 += d * d
+        self.s1 = s1
+        self.m2 = m2
+
+    cdef inline bint _push(self, int64_t curr):
+        cdef int64_t dt, old
+        cdef double old_mean, new_mean
+        cdef bint ready = False
+
+        self.version += 1
+        try:
+            if self.msg_t0 < 0 or self.msg_t0 > curr:
+                self.msg_t0 = curr
+                self.msg_tn = curr
+                self._clear()
+            else:
+                dt = curr - self.msg_tn
+                old_mean = <double>self.s1 / self.count if self.count else 0.
+                if self.count == self.size:
+                    old = self.buf[self.head]
+                    self.s1 += dt - old
+                    new_mean = <double>self.s1 / self.count
+                    self.m2 += (dt - old) * (dt - new_mean + old - old_mean)
+                else:
+                    self.count += 1
+                    self.s1 += dt
+                    new_mean = <double>self.s1 / self.count
+                    self.m2 += (dt - old_mean) * (dt - new_mean)
+                self.buf[self.head] = dt
+                self.head += 1
+                if self.head == self.size:
+                    self.head = 0
+                    self._resync()
+                self.msg_tn = curr
+                ready = not self.pending
+                self.pending = True
+        finally:
+            self.version += 1
+        return ready
+
+    def reset(self):
+        self.version += 1
+        try:
+            self._clear()
+        finally:
+            self.version += 1
+
+    def view(self):
+        """Return the stored deltas, unordered once the buffer has wrapped."""
+        return self._arr[:self.count]
+
+    def snapshot(self):
+        """Return (n, s1, m2, msg_tn, min_delta, max_delta) without locking."""
+        cdef unsigned long v1
+        cdef Py_ssize_t i, n
+        cdef int64_t s1, msg_tn, lo, hi, x
+        cdef double m2
+        cdef int attempt
+
+        for attempt in range(_MAX_SNAPSHOT_RETRIES):
+            v1 = self.version
+            if v1 & 1:
+                continue
+            n = self.count
+            s1 = self.s1
+            m2 = self.m2
+            msg_tn = self.msg_tn
+            lo = hi = self.buf[0] if n else 0
+            for i in range(1, n):
+                x = self.buf[i]
+                if x < lo:
+                    lo = x
+                elif x > hi:
+                    hi = x
+            if self.version == v1:
+                return n, s1, m2, msg_tn, lo, hi
+        raise RuntimeError('TopicState was left mid-update by a failed writer')
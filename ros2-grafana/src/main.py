@@ -1,13 +1,28 @@
-mport argparse
-import subprocess
-from datetime import datetime
+import argparse
+import functools
+import queue
 import re
 import threading
+import time
 import influxdb_client
+from ros2cli.node.direct import DirectNode
+from ros2topic.api import get_topic_names
 
 import hz  # Bu dosya ROS2'dan gelen mesajların hızını hesaplamak için gerekli fonksiyonları içeriyor.
 
 
+_TAG_ESCAPE_TABLE = str.maketrans({'\\': '\\\\', ',': '\\,', '=': '\\=', ' ': '\\ '})
+
+
+@functools.lru_cache(maxsize=None)
+def escape_tag_value(value: str) -> str:
+    """
+    Line protocol tag değerindeki özel karakterleri kaçırır.
+    Topic adları değişmediği için sonuç önbelleğe alınır.
+    """
+    return value.translate(_TAG_ESCAPE_TABLE)
+
+
 class InfluxDbAccessor:
     """
     InfluxDB veritabanı işlemleri için kullanılan sınıf.
@@ -25,55 +40,95 @@ class InfluxDbAccessor:
         self.token = token
         self.org = org
         self.bucket_name = bucket_name
+        # Tek bir istemci ve batching yapan write_api'yi tüm yazmalar için paylaşıyoruz
+        self.client = influxdb_client.InfluxDBClient(url=self.url, token=self.token, org=self.org)
+        self.write_api = self.client.write_api(
+            write_options=influxdb_client.client.write_api.WriteOptions(batch_size=500, flush_interval=1_000))
 
     def create_bucket(self):
         """
         Belirtilen bucket'ı oluşturur. Eğer varsa, önceki bucket'ı siler.
         """
-        with influxdb_client.InfluxDBClient(url=self.url, token=self.token) as client:
-            # Buckets API'si ile işlem yapıyoruz
-            buckets_api = client.buckets_api()
-            buckets = buckets_api.find_buckets().buckets
-            # Mevcut bucket'ları kontrol edip, eski bucket'ları siliyoruz
-            my_buckets = [bucket for bucket in buckets if bucket.name == self.bucket_name]
-            _ = [buckets_api.delete_bucket(my_bucket) for my_bucket in my_buckets]
-            _ = buckets_api.create_bucket(bucket_name=self.bucket_name, org=self.org)
-
-    def write_point(self, measurement_datetime, topic_name: str, hz: float):
+        # Buckets API'si ile işlem yapıyoruz
+        buckets_api = self.client.buckets_api()
+        buckets = buckets_api.find_buckets().buckets
+        # Mevcut bucket'ları kontrol edip, eski bucket'ları siliyoruz
+        my_buckets = [bucket for bucket in buckets if bucket.name == self.bucket_name]
+        _ = [buckets_api.delete_bucket(my_bucket) for my_bucket in my_buckets]
+        _ = buckets_api.create_bucket(bucket_name=self.bucket_name, org=self.org)
+
+    def write_points(self, measurement_datetime: int, hz_dict: dict[str, float]):
         """
-        InfluxDB'ye bir veri noktası yazar.
-        :param measurement_datetime: Ölçüm zamanı
-        :param topic_name: Mesajın geldiği ROS topic adı
-        :param hz: Mesajın hızı (Hz cinsinden)
+        Tüm topic'lerin hızlarını tek bir istekte InfluxDB'ye yazar.
+        Point nesneleri yerine doğrudan line protocol satırları oluşturulur.
+        :param measurement_datetime: Ölçüm zamanı (nanosaniye)
+        :param hz_dict: Topic adından hıza (Hz cinsinden) eşleme
         """
-        with influxdb_client.InfluxDBClient(url=self.url, token=self.token, org=self.org) as client:
-            write_api = client.write_api(write_options=influxdb_client.client.write_api.SYNCHRONOUS)
-            # Veriyi oluşturup yazıyoruz
-            p = influxdb_client.Point('ros2_topic')\
-                .tag('topic_name', topic_name)\
-                .time(measurement_datetime)\
-                .field('topic_rate_hz', hz)
-
-            write_api.write(bucket=self.bucket_name, record=p)
+        if not hz_dict:
+            return
+        payload = '\n'.join(
+            f'ros2_topic,topic_name={escape_tag_value(topic_name)} topic_rate_hz={hz} {measurement_datetime}'
+            for topic_name, hz in hz_dict.items())
+        self.write_api.write(bucket=self.bucket_name, record=payload,
+                             write_precision=influxdb_client.WritePrecision.NS)
+
+    def close(self):
+        """
+        Bekleyen yazmaları gönderir ve bağlantıyı kapatır.
+        """
+        self.write_api.close()
+        self.client.close()
 
 
 # Global bir InfluxDbAccessor nesnesi
 db: InfluxDbAccessor = None
 
+# Yazılmayı bekleyen ölçümler; InfluxDB takılırsa en eski ölçümler atılır
+WRITE_QUEUE_SIZE = 60
+write_queue: queue.Queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+# Kapanışta yazma thread'ini en fazla bu kadar bekliyoruz
+FLUSHER_JOIN_TIMEOUT_SEC = 10.0
+
 
 def update_hz_cb(hz_dict: dict[str, float]):
     """
     Mesaj hızı verilerini işleyen callback fonksiyonu.
-    Her bir topic için hızı InfluxDB'ye yazar.
+    Ölçümü yazma kuyruğuna ekler; ROS döngüsünü hiçbir zaman bloklamaz.
+    """
+    measurement_datetime = time.time_ns()  # Zaman damgasını nanosaniye olarak alıyoruz
+    put_drop_oldest((measurement_datetime, dict(hz_dict)))
+
+
+def put_drop_oldest(item):
     """
-    def run(hz_dict):
-        measurement_datetime = int(datetime.now().timestamp() * 1e9)  # Zaman damgasını alıyoruz
-        for topic, hz in hz_dict.items():
-            # Her topic için veriyi yazıyoruz
-            db.write_point(measurement_datetime, topic, hz)
-    # Bu işlemi ayrı bir thread'de çalıştırıyoruz
-    thread = threading.Thread(target=run, args=(hz_dict,))
-    thread.start()
+    Öğeyi yazma kuyruğuna bloklamadan ekler; kuyruk doluysa en eski öğeyi atar.
+    """
+    while True:
+        try:
+            write_queue.put_nowait(item)
+            return
+        except queue.Full:
+            # Kuyruk doluysa en eski ölçümü atıp tekrar deniyoruz
+            try:
+                write_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def flush_worker():
+    """
+    Yazma kuyruğunu tüketen tek arka plan thread'i.
+    Kuyruğa None konulduğunda sonlanır.
+    """
+    while True:
+        item = write_queue.get()
+        if item is None:
+            break
+        try:
+            db.write_points(*item)
+        except Exception as e:
+            # Tek bir hatalı yazma thread'i öldürmemeli; ölçümü atıp devam ediyoruz
+            print(f'InfluxDB yazma hatası: {e!r}')
 
 
 def subscribe_topic_hz(topic_list: list[str], window_size: int):
@@ -93,13 +148,15 @@ def make_topic_list(ignore_regexp: str, target_regexp: str) -> list[str]:
     """
     ROS2 topic listesini alır ve belirli regex'lere göre filtreler.
     """
-    topic_list = subprocess.run(['ros2', 'topic', 'list'],
-                                capture_output=True,
-                                text=True)
-    topic_list = topic_list.stdout.splitlines()
+    # `ros2 topic list` alt sürecini başlatmak yerine ROS graph'ını doğrudan sorguluyoruz.
+    # DirectNode, node'u oluşturup keşif için kısa bir süre bekler.
+    with DirectNode(None) as node:
+        topic_list = get_topic_names(node=node.node, include_hidden_topics=False)
     # target_regexp ile eşleşen, ignore_regexp ile eşleşmeyen topic'leri seçiyoruz
+    target_re = re.compile(target_regexp)
+    ignore_re = re.compile(ignore_regexp)
     topic_list = [topic for topic in topic_list if \
-        re.search(target_regexp, topic) and not re.search(ignore_regexp, topic)]
+        target_re.search(topic) and not ignore_re.search(topic)]
 
     len_topic_list = len(topic_list)
     print(f'İzlenen topic sayısı: {len_topic_list}')
@@ -117,7 +174,7 @@ def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--ignore_regexp', type=str, default='(parameter_events|rosout|debug|tf)')
     parser.add_argument('--target_regexp', type=str, default='.*')
-    parser.add_argument('--window_size', type=int, default=10)
+    parser.add_argument('--window_size', type=hz.positive_int, default=10)
     parser.add_argument('--token', type=str, default='my-super-secret-auth-token',
                         help='InfluxDB token')
     parser.add_argument('--org', type=str, default='my-org',
@@ -143,7 +200,16 @@ def main():
 
     # Topic listelerini oluşturuyoruz
     topic_list = make_topic_list(args.ignore_regexp, args.target_regexp)
-    subscribe_topic_hz(topic_list, args.window_size)  # Topic'leri izlemeye başlıyoruz
+
+    # InfluxDB'ye yazma işlemlerini tek bir arka plan thread'inde yapıyoruz
+    flusher = threading.Thread(target=flush_worker, daemon=True)
+    flusher.start()
+    try:
+        subscribe_topic_hz(topic_list, args.window_size)  # Topic'leri izlemeye başlıyoruz
+    finally:
+        put_drop_oldest(None)  # Kuyruktaki ölçümler yazıldıktan sonra thread'i durduruyoruz
+        flusher.join(timeout=FLUSHER_JOIN_TIMEOUT_SEC)
+        db.close()  # Kalan verileri gönderip bağlantıyı kapatıyoruz
 
 
 if __name__ == '__main__':
@@ -0,0 +1,131 @@
+"""Per-topic sliding-window state shared by hz.py and its tests.
+
+``TopicState`` is the compiled ``hz_core.TopicState`` when that extension has
+been built (``cythonize -i hz_core.pyx`` in this directory), and the
+pure-Python ``PyTopicState`` otherwise.
+"""
+import math
+import time
+import numpy as np
+
+# Timestamps are int nanoseconds; keep comparisons against them in int math.
+ONE_SEC_NS = 10**9
+
+class PyTopicState:
+    """Sliding window of inter-arrival times for a single topic.
+
+    The deltas live in a fixed-size int64 ring buffer, and their sum (s1) and
+    sum of squares (s2) are updated on every insert/evict so the mean and
+    variance are available in O(1).
+
+    Only the topic's own subscription callback writes to the window, so no
+    lock is needed on the write side. The writer bumps ``version`` to an odd
+    value before touching the window and back to an even value afterwards;
+    readers use it as a seqlock to take a consistent snapshot. The only field
+    the reader writes back is the ``pending`` flag, via compute_hz.
+    """
+
+    __slots__ = ('buf', 'size', 'head', 'count', 's1', 's2',
+                 'msg_t0', 'msg_tn', 'pending', 'version')
+
+    def __init__(self, window_size):
+        if window_size < 1:
+            raise ValueError('window_size must be a positive integer')
+        self.buf = np.empty(window_size, dtype=np.int64)
+        self.size = window_size
+        self.head = 0
+        self.count = 0
+        self.s1 = 0
+        self.s2 = 0
+        self.msg_t0 = -1
+        self.msg_tn = 0
+        self.pending = False
+        self.version = 0
+
+    def on_sample(self, curr):
+        """Record a message received at ``curr`` nanoseconds.
+
+        Returns True for the first sample since the reader last cleared
+        ``pending`` (see compute_hz), so the topic is queued once per report.
+        """
+        ready = False
+        self.version += 1
+        # Always leave version even again, or readers would spin forever.
+        try:
+            if self.msg_t0 < 0 or self.msg_t0 > curr:
+                self.msg_t0 = curr
+                self.msg_tn = curr
+                self.head = self.count = self.s1 = self.s2 = 0
+            else:
+                dt = curr - self.msg_tn
+                head = self.head
+                if self.count == self.size:
+                    old = int(self.buf[head])
+                    self.s1 += dt - old
+                    self.s2 += dt * dt - old * old
+                else:
+                    self.count += 1
+                    self.s1 += dt
+                    self.s2 += dt * dt
+                self.buf[head] = dt
+                head += 1
+                self.head = 0 if head == self.size else head
+                self.msg_tn = curr
+                ready = not self.pending
+                self.pending = True
+        finally:
+            self.version += 1
+        return ready
+
+    def reset(self):
+        self.version += 1
+        try:
+            self.head = self.count = self.s1 = self.s2 = 0
+        finally:
+            self.version += 1
+
+    def view(self):
+        """Return the stored deltas, unordered once the buffer has wrapped."""
+        return self.buf[:self.count]
+
+    def snapshot(self):
+        """Return (n, s1, m2, msg_tn, min_delta, max_delta) without locking.
+
+        ``m2`` is the sum of squared deviations from the mean.
+        """
+        while True:
+            v1 = self.version
+            if v1 & 1:
+                time.sleep(0)
+                continue
+            n, s1, s2, msg_tn = self.count, self.s1, self.s2, self.msg_tn
+            view = self.buf[:n]
+            min_delta = int(view.min()) if n else 0
+            max_delta = int(view.max()) if n else 0
+            if self.version == v1:
+                break
+        # s1/s2 are exact Python ints, so n*s2 - s1*s1 does not cancel.
+        m2 = (n * s2 - s1 * s1) / n if n else 0.
+        return n, s1, m2, msg_tn, min_delta, max_delta
+
+def compute_hz(state):
+    """Return (rate, min_delta, max_delta, std_dev, n) for ``state``, in Hz and ns.
+
+    Clears ``state.pending`` first, so a sample arriving from here on queues
+    the topic for the next report. Returns None while the window is empty.
+    """
+    state.pending = False
+    n, s1, m2, _, min_delta, max_delta = state.snapshot()
+    if n == 0:
+        return None
+
+    rate = ONE_SEC_NS * n / s1 if s1 > 0 else 0
+    std_dev = math.sqrt(max(m2, 0.) / n)
+    return rate, min_delta, max_delta, std_dev, n
+
+TopicState = PyTopicState
+try:
+    from hz_core import TopicState
+except ModuleNotFoundError as e:
+    if e.name != 'hz_core':
+        raise
@@ -0,0 +1,30 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from filter_expr import compile_filter_expr  # noqa: E402
+
+
+@pytest.mark.parametrize('expr', [
+    "m.data == 'foo'",
+    "lambda m: m.data == 'foo'",
+])
+def test_filter_expr_forms(expr):
+    predicate = compile_filter_expr(expr)
+    assert predicate(SimpleNamespace(data='foo'))
+    assert not predicate(SimpleNamespace(data='bar'))
+
+
+def test_filter_expr_sees_m_in_generator_expression():
+    predicate = compile_filter_expr('any(v > m.k for v in m.data)')
+    assert predicate(SimpleNamespace(k=2, data=[1, 3]))
+    assert not predicate(SimpleNamespace(k=5, data=[1, 3]))
+
+
+def test_filter_expr_rejects_invalid_syntax():
+    with pytest.raises(SyntaxError):
+        compile_filter_expr('m.data ==')
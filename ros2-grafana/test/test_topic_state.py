@@ -0,0 +1,148 @@
+import math
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from topic_state import PyTopicState, compute_hz  # noqa: E402
+
+WINDOW_SIZE = 100
+
+
+def sample_stream(seed, count=20000):
+    """Yield increasing timestamps in ns, with an occasional clock jump back."""
+    rng = random.Random(seed)
+    t = 5
+    for _ in range(count):
+        t += rng.randint(1, 10**9)
+        if rng.random() < 0.001:
+            t = max(1, t - 10**12)
+        yield t
+
+
+def reference_snapshot(timestamps, window_size):
+    """Recompute (n, s1, m2, msg_tn, min, max) for the final window from scratch."""
+    deltas = []
+    msg_t0 = -1
+    msg_tn = 0
+    for t in timestamps:
+        if msg_t0 < 0 or msg_t0 > t:
+            msg_t0 = msg_tn = t
+            deltas = []
+        else:
+            deltas.append(t - msg_tn)
+            msg_tn = t
+    deltas = deltas[-window_size:]
+    n = len(deltas)
+    s1 = sum(deltas)
+    m2 = sum((d - s1 / n) ** 2 for d in deltas) if n else 0.
+    return n, s1, m2, msg_tn, min(deltas, default=0), max(deltas, default=0)
+
+
+def assert_snapshot_equal(actual, expected):
+    n, s1, m2, msg_tn, min_delta, max_delta = actual
+    assert (n, s1, msg_tn, min_delta, max_delta) == \
+        (expected[0], expected[1], expected[3], expected[4], expected[5])
+    assert math.isclose(m2, expected[2], rel_tol=1e-9, abs_tol=1.)
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_py_topic_state_matches_reference(seed):
+    state = PyTopicState(WINDOW_SIZE)
+    timestamps = []
+    for t in sample_stream(seed):
+        state.on_sample(t)
+        timestamps.append(t)
+    assert_snapshot_equal(state.snapshot(), reference_snapshot(timestamps, WINDOW_SIZE))
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_compiled_topic_state_matches_python(seed):
+    hz_core = pytest.importorskip('hz_core')
+    compiled = hz_core.TopicState(WINDOW_SIZE)
+    python = PyTopicState(WINDOW_SIZE)
+    for i, t in enumerate(sample_stream(seed)):
+        assert compiled.on_sample(t) == python.on_sample(t)
+        if i % 997 == 0:
+            assert_snapshot_equal(compiled.snapshot(), python.snapshot())
+    assert_snapshot_equal(compiled.snapshot(), python.snapshot())
+
+
+def test_on_sample_reports_once_until_reader_drains():
+    state = PyTopicState(WINDOW_SIZE)
+    ready = [t for t in range(10**7, 3 * 10**9, 10**7) if state.on_sample(t)]
+    # The first sample only starts the window; nothing drains the state
+    # here, so only the first windowed sample is reported.
+    assert ready == [2 * 10**7]
+
+
+def test_on_sample_reports_again_after_each_drain():
+    state = PyTopicState(WINDOW_SIZE)
+    ready = []
+    for t in range(10**7, 5 * 10**9, 10**7):
+        if state.on_sample(t):
+            ready.append(t)
+        if t % 10**9 == 0:
+            # What the 1 Hz emit timer does via ROSTopicHz.get_hz.
+            assert compute_hz(state) is not None
+    assert ready == [2 * 10**7] + [k * 10**9 + 10**7 for k in range(1, 5)]
+
+
+def test_every_active_topic_reported_on_every_tick():
+    """Drive on_sample and compute_hz the way the subscriptions and the emit
+    timer do, and check no topic skips a tick."""
+    rng = random.Random(0)
+    periods = {'/slow': 10**8, '/mid': 33_333_333, '/fast': 10**7}
+    states = {topic: PyTopicState(WINDOW_SIZE) for topic in periods}
+    events = []
+    for topic, period in periods.items():
+        t = rng.randint(1, period)
+        while t < 20 * 10**9:
+            events.append((t, topic))
+            t += period + rng.randint(-period // 10, period // 10)
+    ticks = range(5 * 10**8, 20 * 10**9, 10**9)
+    events.extend((t, None) for t in ticks)
+    events.sort(key=lambda event: event[0])
+
+    ready = set()
+    reported = {topic: [] for topic in periods}
+    for t, topic in events:
+        if topic is not None:
+            if states[topic].on_sample(t):
+                ready.add(topic)
+            continue
+        ready, drained = set(), ready
+        for name in drained:
+            hz = compute_hz(states[name])
+            if hz:
+                reported[name].append((t, hz[0]))
+
+    for topic, period in periods.items():
+        assert [t for t, _ in reported[topic]] == list(ticks)
+        for _, rate in reported[topic][1:]:
+            assert rate == pytest.approx(10**9 / period, rel=0.1)
+
+
+@pytest.mark.parametrize('window_size', [0, -1])
+def test_py_topic_state_rejects_empty_window(window_size):
+    with pytest.raises(ValueError):
+        PyTopicState(window_size)
+
+
+@pytest.mark.parametrize('window_size', [0, -1])
+def test_compiled_topic_state_rejects_empty_window(window_size):
+    hz_core = pytest.importorskip('hz_core')
+    with pytest.raises(ValueError):
+        hz_core.TopicState(window_size)
+
+
+def test_py_topic_state_writer_error_does_not_wedge_readers():
+    state = PyTopicState(WINDOW_SIZE)
+    state.on_sample(10)
+    with pytest.raises(TypeError):
+        state.on_sample('not a timestamp')
+    assert state.version % 2 == 0
+    assert state.snapshot()[0] == 0